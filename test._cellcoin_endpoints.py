@@ -6,25 +6,89 @@ Gera relatório markdown com resultados dos testes
 """
 
 import os
+import sys
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 import json
-from datetime import datetime
-from typing import Dict, Any, Optional, List
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional, List, Iterator
 from dotenv import load_dotenv
 from colorama import init, Fore, Style
 from tabulate import tabulate
 from pydantic import BaseModel
-import uuid
+import secrets
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+try:
+    import orjson
+except ImportError:  # orjson é opcional; sem ele usamos o json da stdlib
+    orjson = None
 
 # Inicializar colorama para cores no terminal
 init()
 
+# Prefixo/sufixo ANSI dos títulos de resultado, resolvidos uma única vez
+RESULT_TITLE_PREFIX = f"\n{Fore.CYAN}=== "
+RESULT_TITLE_SUFFIX = f" ==={Style.RESET_ALL}\n"
+
+# Menu do modo interativo, montado uma única vez
+INTERACTIVE_MENU = (
+    f"\n{Fore.CYAN}Opções disponíveis:\n"
+    "1. Teste DICT Lookup (consulta chave PIX)\n"
+    "2. Teste Pagamento PIX\n"
+    "3. Consulta Status PIX\n"
+    "4. Teste TED\n"
+    "5. Teste Transferência Interna\n"
+    "6. Executar Pipeline Completo\n"
+    "7. Gerar Relatório e Sair\n"
+    "8. Sair sem relatório\n"
+    f"{Style.RESET_ALL}\n"
+)
+
 # Carregar variáveis de ambiente
 load_dotenv()
 
+# Únicos headers de resposta exibidos no relatório
+REPORTED_HEADERS = ("Content-Type", "x-ratelimit-remaining", "x-request-id")
+# Limite de bytes guardados de respostas não-JSON (ex.: páginas HTML de erro do proxy)
+RAW_BODY_LIMIT = 8 * 1024
+
+def _pretty_json(obj: Any) -> str:
+    """Serializa em JSON indentado (2 espaços, UTF-8), usando orjson quando disponível"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode()
+        except TypeError:
+            # Ex.: inteiros acima de 64 bits, que o orjson não serializa
+            pass
+    return json.dumps(obj, indent=2, ensure_ascii=False)
+
+def _encode_body(payload: Any) -> Optional[bytes]:
+    """Serializa o corpo da requisição com orjson; None indica usar o encoder do requests"""
+    if orjson is None or payload is None:
+        return None
+    try:
+        return orjson.dumps(payload)
+    except TypeError:
+        return None
+
+def _loads_json(data: bytes) -> Any:
+    """Decodifica JSON a partir de bytes, usando orjson quando disponível"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
 class TestResult:
     """Classe para armazenar resultados de teste"""
+    # Sem __dict__ por instância: um TestResult é criado a cada chamada HTTP
+    __slots__ = ("test_name", "endpoint", "method", "timestamp", "request_payload",
+                 "response_status", "response_body", "response_headers", "execution_time",
+                 "success", "error_message", "request_payload_json", "response_body_json")
+    
     def __init__(self, test_name: str, endpoint: str, method: str):
         self.test_name = test_name
         self.endpoint = endpoint
@@ -37,16 +101,29 @@ class TestResult:
         self.execution_time: Optional[float] = None
         self.success: bool = False
         self.error_message: Optional[str] = None
+        # JSON pré-serializado, calculado uma vez ao registrar o resultado
+        self.request_payload_json: Optional[str] = None
+        self.response_body_json: Optional[str] = None
+        
+    def encode_json(self):
+        """Serializa payload e resposta para reaproveitar em todos os relatórios"""
+        if self.request_payload:
+            self.request_payload_json = _pretty_json(self.request_payload)
+        if self.response_body:
+            self.response_body_json = _pretty_json(self.response_body)
 
 class TestSession:
     """Classe para gerenciar sessão de testes"""
+    __slots__ = ("session_id", "start_time", "results", "end_time")
+    
     def __init__(self):
-        self.session_id = str(uuid.uuid4())[:8]
+        self.session_id = secrets.token_hex(4)
         self.start_time = datetime.now()
         self.results: List[TestResult] = []
         self.end_time: Optional[datetime] = None
         
     def add_result(self, result: TestResult):
+        result.encode_json()
         self.results.append(result)
         
     def finish(self):
@@ -63,19 +140,66 @@ class CelcoinConfig:
     BASE_URL = os.getenv("CELCOIN_BASE_URL", "https://sandbox.openfinance.celcoin.dev")
     CLIENT_ID = os.getenv("CELCOIN_CLIENT_ID")
     CLIENT_SECRET = os.getenv("CELCOIN_CLIENT_SECRET")
+    TOKEN_PATH = "/v5/token"
+    # Timeout (conexão, leitura) em segundos para todas as requisições
+    REQUEST_TIMEOUT = (5.0, 10.0)
+    TOKEN_CACHE_FILE = os.getenv("CELCOIN_TOKEN_CACHE_FILE", ".celcoin_token.json")
+    # Margem de segurança antes da expiração real do token
+    TOKEN_EXPIRY_MARGIN = 60
+    # Endpoint opcional de pagamentos PIX em lote; sem ele os lotes viram chamadas individuais concorrentes
+    PIX_BATCH_PATH = os.getenv("CELCOIN_PIX_BATCH_PATH")
+    PIX_BATCH_SIZE = 50
+    # Respostas que indicam endpoint de lote não suportado: só nesses casos há fallback individual
+    PIX_BATCH_UNSUPPORTED_STATUS = (404, 405, 501)
     
     def __init__(self):
         if not self.CLIENT_ID or not self.CLIENT_SECRET:
             raise ValueError("CLIENT_ID e CLIENT_SECRET devem ser configurados no arquivo .env")
+        
+        # Quantidade de pagamentos PIX gerados pelo pipeline (valores maiores servem para teste de carga)
+        pipeline_payments = os.getenv("CELCOIN_PIPELINE_PIX_PAYMENTS", "1")
+        try:
+            self.PIPELINE_PIX_PAYMENTS = int(pipeline_payments)
+        except ValueError:
+            raise ValueError(f"CELCOIN_PIPELINE_PIX_PAYMENTS deve ser um número inteiro (recebido: {pipeline_payments!r})") from None
+        if self.PIPELINE_PIX_PAYMENTS < 1:
+            raise ValueError("CELCOIN_PIPELINE_PIX_PAYMENTS deve ser maior ou igual a 1")
 
 class ReportGenerator:
     """Gerador de relatórios em Markdown"""
     
+    # Templates dos blocos repetidos a cada resultado, definidos uma única vez
+    RESULT_TEMPLATE = """### %(i)d. %(emoji)s %(test_name)s
+
+**Endpoint:** `%(method)s %(endpoint)s`  
+**Timestamp:** %(timestamp)s  
+**Status HTTP:** `%(status)s`  
+**Tempo de Execução:** %(execution_time).3fs  
+
+"""
+    JSON_BLOCK_TEMPLATE = """#### %s
+```json
+%s
+```
+
+"""
+    ERROR_BLOCK_TEMPLATE = """#### ⚠️ Erro
+```
+%s
+```
+
+"""
+    
     @staticmethod
-    def generate_report(session: TestSession) -> str:
-        """Gera relatório completo em markdown"""
+    def generate_report_iter(session: TestSession) -> Iterator[str]:
+        """Gera o relatório em fragmentos, permitindo gravação em streaming"""
+        
+        total = len(session.results)
+        n_ok = sum(1 for r in session.results if r.success)
+        n_fail = total - n_ok
+        success_rate = (n_ok / total * 100) if total else 0.0
         
-        report = f"""# 🏦 Relatório de Testes - Celcoin BaaS
+        yield f"""# 🏦 Relatório de Testes - Celcoin BaaS
 
 ## 📊 Resumo da Sessão
 
@@ -85,10 +209,10 @@ class ReportGenerator:
 | **Data/Hora Início** | {session.start_time.strftime('%d/%m/%Y %H:%M:%S')} |
 | **Data/Hora Fim** | {session.end_time.strftime('%d/%m/%Y %H:%M:%S') if session.end_time else 'Em andamento'} |
 | **Duração Total** | {session.get_duration()} |
-| **Total de Testes** | {len(session.results)} |
-| **Sucessos** | {len([r for r in session.results if r.success])} |
-| **Falhas** | {len([r for r in session.results if not r.success])} |
-| **Taxa de Sucesso** | {(len([r for r in session.results if r.success]) / len(session.results) * 100):.1f}% |
+| **Total de Testes** | {total} |
+| **Sucessos** | {n_ok} |
+| **Falhas** | {n_fail} |
+| **Taxa de Sucesso** | {success_rate:.1f}% |
 
 ---
 
@@ -97,56 +221,36 @@ class ReportGenerator:
 """
 
         for i, result in enumerate(session.results, 1):
-            status_emoji = "✅" if result.success else "❌"
-            
-            report += f"""### {i}. {status_emoji} {result.test_name}
-
-**Endpoint:** `{result.method} {result.endpoint}`  
-**Timestamp:** {result.timestamp.strftime('%H:%M:%S')}  
-**Status HTTP:** `{result.response_status}`  
-**Tempo de Execução:** {result.execution_time:.3f}s  
-
-"""
+            yield ReportGenerator.RESULT_TEMPLATE % {
+                "i": i,
+                "emoji": "✅" if result.success else "❌",
+                "test_name": result.test_name,
+                "method": result.method,
+                "endpoint": result.endpoint,
+                "timestamp": result.timestamp.strftime('%H:%M:%S'),
+                "status": result.response_status,
+                "execution_time": result.execution_time,
+            }
 
             if result.request_payload:
-                report += f"""#### 📤 Request Payload
-```json
-{json.dumps(result.request_payload, indent=2, ensure_ascii=False)}
-```
-
-"""
+                payload_json = result.request_payload_json or _pretty_json(result.request_payload)
+                yield ReportGenerator.JSON_BLOCK_TEMPLATE % ("📤 Request Payload", payload_json)
 
             if result.response_body:
-                report += f"""#### 📥 Response Body
-```json
-{json.dumps(result.response_body, indent=2, ensure_ascii=False)}
-```
-
-"""
+                body_json = result.response_body_json or _pretty_json(result.response_body)
+                yield ReportGenerator.JSON_BLOCK_TEMPLATE % ("📥 Response Body", body_json)
 
             if result.response_headers:
-                important_headers = {k: v for k, v in result.response_headers.items() 
-                                   if k.lower() in ['content-type', 'x-ratelimit-remaining', 'x-request-id']}
-                if important_headers: 
-                    report += f"""#### 📋 Response Headers
-```json
-{json.dumps(important_headers, indent=2, ensure_ascii=False)}
-```
-
-"""
+                headers_json = _pretty_json(result.response_headers)
+                yield ReportGenerator.JSON_BLOCK_TEMPLATE % ("📋 Response Headers", headers_json)
 
             if result.error_message:
-                report += f"""#### ⚠️ Erro
-```
-{result.error_message}
-```
-
-"""
+                yield ReportGenerator.ERROR_BLOCK_TEMPLATE % result.error_message
 
-            report += "---\n\n"
+            yield "---\n\n"
 
         # Pipeline de execução
-        report += """## 🔄 Pipeline de Execução
+        yield """## 🔄 Pipeline de Execução
 
 ### Ordem Recomendada de Testes:
 
@@ -162,11 +266,20 @@ class ReportGenerator:
 """
 
         if session.results:
-            avg_time = sum(r.execution_time or 0 for r in session.results) / len(session.results)
-            fastest = min(r.execution_time or float('inf') for r in session.results)
-            slowest = max(r.execution_time or 0 for r in session.results)
+            # Uma única passada para média, mínimo e máximo
+            t_sum = 0.0
+            fastest = float('inf')
+            slowest = 0.0
+            for r in session.results:
+                t = r.execution_time or 0
+                t_sum += t
+                if t and t < fastest:
+                    fastest = t
+                if t > slowest:
+                    slowest = t
+            avg_time = t_sum / total
             
-            report += f"""| Métrica | Valor |
+            yield f"""| Métrica | Valor |
 |---------|-------|
 | **Tempo Médio** | {avg_time:.3f}s |
 | **Mais Rápido** | {fastest:.3f}s |
@@ -174,7 +287,7 @@ class ReportGenerator:
 
 """
 
-        report += f"""---
+        yield f"""---
 
 ## 🔧 Configuração do Ambiente
 
@@ -187,7 +300,10 @@ class ReportGenerator:
 *Relatório gerado automaticamente pelo Celcoin BaaS Tester*
 """
 
-        return report
+    @staticmethod
+    def generate_report(session: TestSession) -> str:
+        """Gera relatório completo em markdown"""
+        return "".join(ReportGenerator.generate_report_iter(session))
 
 class CelcoinTester:
     """Classe principal para testes da API Celcoin"""
@@ -198,129 +314,288 @@ class CelcoinTester:
         self.token_expires_at: Optional[datetime] = None
         self.session = TestSession()
         
+        # Single-flight do refresh: chamadas concorrentes compartilham uma única autenticação
+        self._refresh_lock = threading.Lock()
+        self._refresh_count = 0
+        self._last_refresh_ok = False
+        
+        self._log_lock = threading.Lock()
+        
+        # Threads do pipeline acumulam seus resultados aqui para registrá-los em ordem
+        self._collected = threading.local()
+        
+        # Sessão HTTP persistente: reaproveita conexões keep-alive (TCP + TLS) com o mesmo host
+        self.http = requests.Session()
+        # Falhas transitórias (conexão recusada, 502/503/504 do sandbox) são retentadas pelo
+        # adapter; raise_on_status=False devolve a última resposta para registrar o status real.
+        # Retries de leitura/status só valem para métodos idempotentes: um POST de pagamento
+        # ou transferência pode já ter movimentado dinheiro e é retentado apenas em falha de conexão
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=16,
+            max_retries=Retry(
+                total=3, connect=3, read=2, backoff_factor=0.5,
+                status_forcelist=[502, 503, 504],
+                allowed_methods=["GET", "PUT", "DELETE"],
+                raise_on_status=False
+            )
+        )
+        # Monta no esquema do BASE_URL (ex.: http:// de um mock local também recebe os retries)
+        scheme = urlsplit(self.config.BASE_URL).scheme or "https"
+        self.http.mount(f"{scheme}://", adapter)
+        
+        # Token com retry mais curto, para não multiplicar a latência de erros de credencial;
+        # é uma única chamada por janela de validade, então usa um pool próprio
+        auth_adapter = HTTPAdapter(
+            max_retries=Retry(
+                total=1, backoff_factor=0.3,
+                status_forcelist=[502, 503, 504],
+                allowed_methods=["POST"],
+                raise_on_status=False
+            )
+        )
+        self.http.mount(f"{self.config.BASE_URL}{self.config.TOKEN_PATH}", auth_adapter)
+        self.http.headers.update({"Content-Type": "application/json"})
+        
+        self._load_cached_token()
+        
+    def _log(self, line: str):
+        """Escreve uma linha de log sob lock, para as threads do pipeline não intercalarem a saída"""
+        # O colorama pode dividir cada escrita nos códigos ANSI, então uma única write() não basta
+        with self._log_lock:
+            sys.stdout.write(line)
+        
     def log_info(self, message: str):
         """Log colorido para informações"""
-        print(f"{Fore.BLUE}[INFO]{Style.RESET_ALL} {message}")
+        self._log(f"{Fore.BLUE}[INFO]{Style.RESET_ALL} {message}\n")
         
     def log_success(self, message: str):
         """Log colorido para sucesso"""
-        print(f"{Fore.GREEN}[SUCCESS]{Style.RESET_ALL} {message}")
+        self._log(f"{Fore.GREEN}[SUCCESS]{Style.RESET_ALL} {message}\n")
         
     def log_error(self, message: str):
         """Log colorido para erros"""
-        print(f"{Fore.RED}[ERROR]{Style.RESET_ALL} {message}")
+        self._log(f"{Fore.RED}[ERROR]{Style.RESET_ALL} {message}\n")
         
     def log_warning(self, message: str):
         """Log colorido para warnings"""
-        print(f"{Fore.YELLOW}[WARNING]{Style.RESET_ALL} {message}")
+        self._log(f"{Fore.YELLOW}[WARNING]{Style.RESET_ALL} {message}\n")
 
-    def _make_request(self, method: str, url: str, payload: Optional[Dict] = None, 
+    def _make_request(self, method: str, path: str, payload: Optional[Dict] = None, 
                      params: Optional[Dict] = None, test_name: str = "") -> TestResult:
         """Método unificado para fazer requisições e registrar resultados"""
         
-        result = TestResult(test_name, url.replace(self.config.BASE_URL, ""), method)
+        result = TestResult(test_name, path, method)
         result.request_payload = payload
         
-        start_time = time.time()
+        start_time = time.perf_counter()
         
         try:
-            headers = self.get_headers() if self.access_token else {"Content-Type": "application/json"}
-            
-            if method.upper() == "POST":
-                response = requests.post(url, headers=headers, json=payload)
-            elif method.upper() == "GET":
-                response = requests.get(url, headers=headers, params=params)
-            elif method.upper() == "PUT":
-                response = requests.put(url, headers=headers, json=payload)
-            elif method.upper() == "DELETE":
-                response = requests.delete(url, headers=headers)
-            else:
+            if method.upper() not in ("POST", "GET", "PUT", "DELETE"):
                 raise ValueError(f"Método HTTP não suportado: {method}")
             
-            result.execution_time = time.time() - start_time
+            # Corpo já serializado vai em data=; sem orjson o requests serializa via json=
+            body = _encode_body(payload) if method.upper() in ("POST", "PUT") else None
+            
+            # Content-Type e Authorization vêm dos headers da sessão
+            response = self.http.request(method.upper(), f"{self.config.BASE_URL}{path}",
+                                         data=body, json=payload if body is None else None,
+                                         params=params, timeout=self.config.REQUEST_TIMEOUT)
+            
+            result.execution_time = time.perf_counter() - start_time
             result.response_status = response.status_code
-            result.response_headers = dict(response.headers)
+            result.response_headers = self._important_headers(response)
             
-            try:
-                result.response_body = response.json()
-            except:
-                result.response_body = {"raw_response": response.text}
+            result.response_body = self._parse_body(response)
             
             result.success = response.status_code in [200, 201, 202]
             
             if not result.success:
-                result.error_message = f"HTTP {response.status_code}: {response.text}"
+                result.error_message = f"HTTP {response.status_code}: {self._raw_text(response)}"
                 
         except Exception as e:
-            result.execution_time = time.time() - start_time
+            result.execution_time = time.perf_counter() - start_time
             result.success = False
             result.error_message = str(e)
             
-        self.session.add_result(result)
+        self._record_result(result)
         return result
 
+    def _record_result(self, result: TestResult):
+        """Registra o resultado na sessão, ou no coletor da thread do pipeline se houver"""
+        collected = getattr(self._collected, "results", None)
+        if collected is not None:
+            collected.append(result)
+        else:
+            self.session.add_result(result)
+
+    def _run_collected(self, results: List[TestResult], fn, *args):
+        """Executa fn guardando em results os resultados registrados pela thread atual"""
+        self._collected.results = results
+        try:
+            fn(*args)
+        finally:
+            self._collected.results = None
+
     def authenticate(self) -> bool:
         """Autenticação OAuth2 Client Credentials"""
         try:
             self.log_info("Iniciando autenticação OAuth2...")
             
-            url = f"{self.config.BASE_URL}/v5/token"
             data = {
                 "client_id": self.config.CLIENT_ID,
                 "client_secret": self.config.CLIENT_SECRET,
                 "grant_type": "client_credentials"
             }
             
-            # Requisição especial para autenticação (form-data)
-            response = requests.post(url, data=data)
+            # Corpo form-urlencoded; Authorization=None remove da chamada o bearer antigo
+            # mantido nos headers da sessão, que conflitaria com as credenciais do cliente
+            start_time = time.perf_counter()
+            response = self.http.request("POST", f"{self.config.BASE_URL}{self.config.TOKEN_PATH}", data=data,
+                                         headers={"Content-Type": "application/x-www-form-urlencoded",
+                                                  "Authorization": None},
+                                         timeout=self.config.REQUEST_TIMEOUT)
             
-            result = TestResult("Autenticação OAuth2", "/v5/token", "POST")
+            result = TestResult("Autenticação OAuth2", self.config.TOKEN_PATH, "POST")
+            result.execution_time = time.perf_counter() - start_time
             result.request_payload = {"client_id": "***", "grant_type": "client_credentials"}
             result.response_status = response.status_code
-            result.response_headers = dict(response.headers)
+            result.response_headers = self._important_headers(response)
             
             if response.status_code == 200:
                 token_data = response.json()
                 result.response_body = {"access_token": "***", "expires_in": token_data.get("expires_in")}
                 result.success = True
                 
-                self.access_token = token_data.get("access_token")
                 expires_in = token_data.get("expires_in", 3600)
+                # Margem limitada à metade da validade, para tokens curtos não nascerem expirados
+                margin = min(self.config.TOKEN_EXPIRY_MARGIN, expires_in // 2)
+                self._set_token(token_data.get("access_token"),
+                                datetime.now() + timedelta(seconds=expires_in - margin))
+                self._save_cached_token()
                 
                 self.log_success(f"Autenticação realizada com sucesso! Token válido por {expires_in}s")
-                self.session.add_result(result)
+                self._record_result(result)
                 return True
             else:
-                result.response_body = response.json() if response.text else {}
+                result.response_body = self._parse_body(response) or {}
                 result.success = False
                 result.error_message = f"Erro na autenticação: {response.status_code}"
                 
                 self.log_error(f"Erro na autenticação: {response.status_code} - {response.text}")
-                self.session.add_result(result)
+                self._record_result(result)
                 return False
                 
         except Exception as e:
             self.log_error(f"Exceção durante autenticação: {str(e)}")
             return False
 
-    def get_headers(self) -> Dict[str, str]:
-        """Retorna headers padrão com token de autenticação"""
-        return {
-            "Authorization": f"Bearer {self.access_token}",
-            "Content-Type": "application/json"
-        }
+    @staticmethod
+    def _important_headers(response: requests.Response) -> Dict[str, str]:
+        """Copia apenas os headers usados no relatório (lookup case-insensitive)"""
+        hdrs = response.headers
+        return {k: hdrs[k] for k in REPORTED_HEADERS if k in hdrs}
+
+    @staticmethod
+    def _raw_text(response: requests.Response) -> str:
+        """Texto da resposta limitado a RAW_BODY_LIMIT bytes, sem decodificar o corpo inteiro"""
+        return response.content[:RAW_BODY_LIMIT].decode(response.encoding or "utf-8", errors="replace")
+
+    @classmethod
+    def _parse_body(cls, response: requests.Response) -> Optional[Dict]:
+        """Decodifica o corpo apenas quando é JSON; demais formatos são guardados truncados"""
+        if not response.content:
+            return None
+        
+        content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+        if content_type.endswith("json"):
+            try:
+                return _loads_json(response.content)
+            except ValueError:
+                pass
+        
+        body: Dict[str, Any] = {"raw_response": cls._raw_text(response)}
+        if len(response.content) > RAW_BODY_LIMIT:
+            body["truncated"] = True
+        return body
+
+    def _set_token(self, access_token: Optional[str], expires_at: Optional[datetime]):
+        """Atualiza o token e o header Authorization mantido nos headers da sessão HTTP"""
+        self.access_token = access_token
+        self.token_expires_at = expires_at
+        if access_token:
+            self.http.headers["Authorization"] = f"Bearer {access_token}"
+        else:
+            self.http.headers.pop("Authorization", None)
+
+    def _token_is_valid(self) -> bool:
+        """Verifica se há token em memória ainda dentro da validade"""
+        return bool(self.access_token and self.token_expires_at and datetime.now() < self.token_expires_at)
+
+    def _ensure_token(self) -> bool:
+        """Garante um token válido, autenticando apenas se necessário"""
+        if self._token_is_valid():
+            return True
+        
+        seen_refresh = self._refresh_count
+        with self._refresh_lock:
+            # Outra thread concluiu um refresh enquanto esperávamos o lock: reaproveita o resultado
+            if self._refresh_count != seen_refresh:
+                return self._last_refresh_ok
+            if self._token_is_valid():
+                return True
+            
+            self._last_refresh_ok = self.authenticate()
+            self._refresh_count += 1
+            return self._last_refresh_ok
+
+    def _load_cached_token(self):
+        """Carrega token salvo em disco por uma execução anterior, se ainda válido"""
+        try:
+            with open(self.config.TOKEN_CACHE_FILE, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            
+            # Só reaproveita tokens emitidos para o mesmo ambiente e cliente
+            if cached.get("base_url") != self.config.BASE_URL or cached.get("client_id") != self.config.CLIENT_ID:
+                return
+            
+            self._set_token(cached.get("access_token"), datetime.fromisoformat(cached["expires_at"]))
+            
+            if self._token_is_valid():
+                self.log_info(f"Reutilizando token em cache (válido até {self.token_expires_at.strftime('%H:%M:%S')})")
+        except (OSError, ValueError, KeyError, TypeError):
+            self._set_token(None, None)
+
+    def _save_cached_token(self):
+        """Persiste o token em disco para reaproveitamento entre execuções"""
+        try:
+            # Arquivo legível apenas pelo dono: contém o bearer token da API de pagamentos
+            fd = os.open(self.config.TOKEN_CACHE_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            os.chmod(self.config.TOKEN_CACHE_FILE, 0o600)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({
+                    "base_url": self.config.BASE_URL,
+                    "client_id": self.config.CLIENT_ID,
+                    "access_token": self.access_token,
+                    "expires_at": self.token_expires_at.isoformat()
+                }, f)
+        except OSError as e:
+            self.log_warning(f"Não foi possível salvar o token em cache: {str(e)}")
 
     def test_pix_dict_lookup(self, pix_key: str, key_type: str) -> Optional[Dict]:
         """Testa consulta DICT para uma chave PIX"""
+        if not self._ensure_token():
+            return None
+
         self.log_info(f"Testando DICT lookup para chave: {pix_key} (tipo: {key_type})")
         
-        url = f"{self.config.BASE_URL}/pix/v1/dict/v2/key"
+        path = "/pix/v1/dict/v2/key"
         payload = {
             "key": pix_key,
             "keyType": key_type
         }
         
-        result = self._make_request("POST", url, payload, test_name=f"DICT Lookup - {key_type}")
+        result = self._make_request("POST", path, payload, test_name=f"DICT Lookup - {key_type}")
         
         if result.success:
             self.log_success("DICT lookup realizado com sucesso!")
@@ -329,13 +604,11 @@ class CelcoinTester:
             self.log_error(f"Erro no DICT lookup: {result.error_message}")
             return None
 
-    def test_pix_payment(self, amount: float, pix_key: str, key_type: str, 
-                        client_code: str, description: str) -> Optional[Dict]:
-        """Testa pagamento PIX"""
-        self.log_info(f"Testando pagamento PIX de R$ {amount:.2f}")
-        
-        url = f"{self.config.BASE_URL}/pix/v1/payment"
-        payload = {
+    @staticmethod
+    def build_pix_payment_payload(amount: float, pix_key: str, key_type: str,
+                                  client_code: str, description: str) -> Dict[str, Any]:
+        """Monta o payload de um pagamento PIX"""
+        return {
             "amount": amount,
             "receiver": {
                 "key": pix_key,
@@ -346,8 +619,14 @@ class CelcoinTester:
             "urgency": "HIGH",
             "initiationType": "MANUAL"
         }
+
+    def _submit_pix_payment(self, payload: Dict[str, Any]) -> Optional[Dict]:
+        """Envia um pagamento PIX já montado e registra o resultado"""
+        amount = payload["amount"]
+        self.log_info(f"Testando pagamento PIX de R$ {amount:.2f}")
         
-        result = self._make_request("POST", url, payload, test_name=f"Pagamento PIX - R$ {amount:.2f}")
+        path = "/pix/v1/payment"
+        result = self._make_request("POST", path, payload, test_name=f"Pagamento PIX - R$ {amount:.2f}")
         
         if result.success:
             self.log_success("Pagamento PIX iniciado com sucesso!")
@@ -356,14 +635,78 @@ class CelcoinTester:
             self.log_error(f"Erro no pagamento PIX: {result.error_message}")
             return None
 
+    def test_pix_payment(self, amount: float, pix_key: str, key_type: str, 
+                        client_code: str, description: str) -> Optional[Dict]:
+        """Testa pagamento PIX"""
+        if not self._ensure_token():
+            return None
+
+        payload = self.build_pix_payment_payload(amount, pix_key, key_type, client_code, description)
+        return self._submit_pix_payment(payload)
+
+    def _submit_pix_batch(self, payments: List[Dict[str, Any]]) -> List[Dict]:
+        """Envia um lote de pagamentos, com fallback para chamadas individuais se o lote não for suportado"""
+        # Verificado a cada lote: com muitos lotes o token pode expirar no meio do envio
+        if not self._ensure_token():
+            return []
+        
+        n = len(payments)
+        
+        if self.config.PIX_BATCH_PATH:
+            self.log_info(f"Testando lote de {n} pagamentos PIX")
+            result = self._make_request("POST", self.config.PIX_BATCH_PATH, {"operations": payments},
+                                        test_name=f"PIX Payment Batch × {n}")
+            if result.success:
+                self.log_success(f"Lote de {n} pagamentos PIX aceito!")
+                return [result.response_body] if result.response_body else []
+            
+            # Timeout, erro de conexão ou 5xx: o servidor pode ter processado parte do lote,
+            # então reenviar individualmente arriscaria pagamentos duplicados
+            if result.response_status not in self.config.PIX_BATCH_UNSUPPORTED_STATUS:
+                self.log_error(f"Erro no lote de pagamentos PIX, sem reenvio: {result.error_message}")
+                return []
+            self.log_warning(f"Lote não suportado (HTTP {result.response_status}); enviando pagamentos individualmente")
+        
+        # Resultados registrados na ordem dos pagamentos, não na ordem de conclusão
+        payment_results: List[List[TestResult]] = [[] for _ in payments]
+        with ThreadPoolExecutor(max_workers=min(n, 16)) as executor:
+            futures = [executor.submit(self._run_collected, results, self._submit_pix_payment, payment)
+                       for results, payment in zip(payment_results, payments)]
+            for future in futures:
+                future.result()
+        
+        responses: List[Dict] = []
+        for results in payment_results:
+            for result in results:
+                self._record_result(result)
+                if result.success and result.response_body:
+                    responses.append(result.response_body)
+        return responses
+
+    def test_pix_payment_batch(self, payments: List[Dict[str, Any]]) -> List[Dict]:
+        """Testa pagamentos PIX em lote (até PIX_BATCH_SIZE operações por requisição)
+        
+        Retorna as respostas bem-sucedidas: uma por lote aceito ou uma por pagamento
+        individual quando o endpoint de lote não está configurado ou responde que não é
+        suportado (404/405/501). Outras falhas do lote não são reenviadas.
+        """
+        responses: List[Dict] = []
+        size = self.config.PIX_BATCH_SIZE
+        for start in range(0, len(payments), size):
+            responses.extend(self._submit_pix_batch(payments[start:start + size]))
+        return responses
+
     def test_pix_status(self, transaction_id: str) -> Optional[Dict]:
         """Consulta status de transação PIX"""
+        if not self._ensure_token():
+            return None
+
         self.log_info(f"Consultando status da transação: {transaction_id}")
         
-        url = f"{self.config.BASE_URL}/pix/v1/payment/status"
+        path = "/pix/v1/payment/status"
         params = {"transactionId": transaction_id}
         
-        result = self._make_request("GET", url, params=params, test_name=f"Status PIX - {transaction_id[:8]}...")
+        result = self._make_request("GET", path, params=params, test_name=f"Status PIX - {transaction_id[:8]}...")
         
         if result.success:
             self.log_success("Status da transação consultado com sucesso!")
@@ -376,9 +719,12 @@ class CelcoinTester:
                          account: str, recipient_name: str, recipient_doc: str,
                          client_code: str) -> Optional[Dict]:
         """Testa transferência TED"""
+        if not self._ensure_token():
+            return None
+
         self.log_info(f"Testando TED de R$ {amount:.2f}")
         
-        url = f"{self.config.BASE_URL}/v5/transactions/banktransfer"
+        path = "/v5/transactions/banktransfer"
         payload = {
             "amount": amount,
             "clientCode": client_code,
@@ -395,7 +741,7 @@ class CelcoinTester:
             "description": "Teste TED via API"
         }
         
-        result = self._make_request("POST", url, payload, test_name=f"TED Transfer - R$ {amount:.2f}")
+        result = self._make_request("POST", path, payload, test_name=f"TED Transfer - R$ {amount:.2f}")
         
         if result.success:
             self.log_success("TED iniciada com sucesso!")
@@ -407,9 +753,12 @@ class CelcoinTester:
     def test_internal_transfer(self, amount: float, debit_account: str, credit_account: str,
                               client_code: str, description: str) -> Optional[Dict]:
         """Testa transferência interna BaaS"""
+        if not self._ensure_token():
+            return None
+
         self.log_info(f"Testando transferência interna de R$ {amount:.2f}")
         
-        url = f"{self.config.BASE_URL}/baas-wallet-transactions-webservice/v1/wallet/internal/transfer"
+        path = "/baas-wallet-transactions-webservice/v1/wallet/internal/transfer"
         payload = {
             "amount": amount,
             "clientRequestId": client_code,
@@ -422,7 +771,7 @@ class CelcoinTester:
             "description": description
         }
         
-        result = self._make_request("POST", url, payload, test_name=f"Transferência Interna - R$ {amount:.2f}")
+        result = self._make_request("POST", path, payload, test_name=f"Transferência Interna - R$ {amount:.2f}")
         
         if result.success:
             self.log_success("Transferência interna iniciada com sucesso!")
@@ -433,27 +782,27 @@ class CelcoinTester:
 
     def display_result(self, title: str, result: Dict):
         """Exibe resultado formatado"""
-        print(f"\n{Fore.CYAN}=== {title} ==={Style.RESET_ALL}")
-        print(json.dumps(result, indent=2, ensure_ascii=False))
-        print()
+        sys.stdout.write(f"{RESULT_TITLE_PREFIX}{title}{RESULT_TITLE_SUFFIX}{_pretty_json(result)}\n\n")
 
     def save_report(self):
         """Salva relatório markdown"""
         self.session.finish()
-        report_content = ReportGenerator.generate_report(self.session)
         
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         filename = f"celcoin_test_report_{timestamp}.md"
         
         try:
-            with open(filename, 'w', encoding='utf-8') as f:
-                f.write(report_content)
+            # Fragmentos vão direto para o arquivo; buffer de 1 MB agrupa as escritas
+            with open(filename, 'w', encoding='utf-8', buffering=1 << 20) as f:
+                f.writelines(ReportGenerator.generate_report_iter(self.session))
             
             self.log_success(f"Relatório salvo em: {filename}")
             print(f"\n{Fore.MAGENTA}📊 Relatório completo disponível em: {filename}{Style.RESET_ALL}")
             
         except Exception as e:
             self.log_error(f"Erro ao salvar relatório: {str(e)}")
+        finally:
+            self.http.close()
 
     def run_pipeline_test(self):
         """Executa pipeline completo de testes"""
@@ -462,31 +811,126 @@ class CelcoinTester:
         print(f"{'='*70}{Style.RESET_ALL}\n")
         
         # 1. Autenticação
-        if not self.authenticate():
+        if not self._ensure_token():
             self.log_error("Pipeline interrompido - falha na autenticação")
             return
         
-        # 2. DICT Lookup
-        self.log_info("Executando DICT Lookup...")
         pix_key = "test@example.com"
-        self.test_pix_dict_lookup(pix_key, "EMAIL")
-        
-        # 3. Pagamento PIX (simulado)
-        self.log_info("Executando Pagamento PIX...")
-        client_code = f"TEST_{uuid.uuid4().hex[:8]}"
-        self.test_pix_payment(10.50, pix_key, "EMAIL", client_code, "Teste automatizado")
-        
-        # 4. Consulta Status (exemplo)
-        self.log_info("Executando Consulta Status...")
-        self.test_pix_status("123456789")
-        
-        # 5. TED
-        self.log_info("Executando TED...")
-        ted_client_code = f"TED_{uuid.uuid4().hex[:8]}"
-        self.test_ted_transfer(100.00, "001", "1234", "12345-6", "João Silva", "12345678901", ted_client_code)
+        ted_client_code = f"TED_{secrets.token_hex(4)}"
+        
+        def pix_flow():
+            # 2. DICT Lookup → 3. Pagamento PIX (simulado): a chave é validada antes de transacionar
+            self.log_info("Executando DICT Lookup...")
+            self.test_pix_dict_lookup(pix_key, "EMAIL")
+            self.log_info("Executando Pagamento PIX...")
+            batcher = PixPaymentBatcher(self)
+            for _ in range(self.config.PIPELINE_PIX_PAYMENTS):
+                batcher.add(self.build_pix_payment_payload(10.50, pix_key, "EMAIL",
+                                                           f"TEST_{secrets.token_hex(4)}", "Teste automatizado"))
+            batcher.flush()
+        
+        steps = [
+            (pix_flow,),
+            # 4. Consulta Status (exemplo)
+            (self.test_pix_status, "123456789"),
+            # 5. TED
+            (self.test_ted_transfer, 100.00, "001", "1234", "12345-6",
+             "João Silva", "12345678901", ted_client_code),
+        ]
+        step_results: List[List[TestResult]] = [[] for _ in steps]
+        
+        # As chamadas independentes rodam em paralelo sobre o pool da sessão HTTP,
+        # então o tempo total fica perto da chamada mais lenta em vez da soma de todas
+        start_time = time.perf_counter()
+        self.log_info("Executando Consulta Status e TED em paralelo...")
+        with ThreadPoolExecutor(max_workers=len(steps)) as executor:
+            futures = [executor.submit(self._run_collected, results, *step)
+                       for results, step in zip(step_results, steps)]
+            for future in futures:
+                future.result()
+        elapsed = time.perf_counter() - start_time
+        
+        # Registra na ordem do pipeline, não na ordem de conclusão das threads
+        for results in step_results:
+            for result in results:
+                self._record_result(result)
         
         print(f"\n{Fore.GREEN}✅ Pipeline completo executado!{Style.RESET_ALL}")
-        print(f"{Fore.CYAN}📊 Total de testes: {len(self.session.results)}{Style.RESET_ALL}")
+        print(f"{Fore.CYAN}📊 Total de testes: {len(self.session.results)} em {elapsed:.2f}s{Style.RESET_ALL}")
+
+    def _handle_dict_lookup(self):
+        """Opção 1: DICT Lookup com dados informados pelo usuário"""
+        print(f"\n{Fore.YELLOW}=== TESTE DICT LOOKUP ==={Style.RESET_ALL}")
+        pix_key = input("Digite a chave PIX: ").strip()
+        print("Tipos disponíveis: CPF, CNPJ, EMAIL, PHONE, EVP")
+        key_type = input("Digite o tipo da chave: ").strip().upper()
+        
+        result = self.test_pix_dict_lookup(pix_key, key_type)
+        if result:
+            self.display_result("DICT LOOKUP RESULT", result)
+
+    def _handle_pix_payment(self):
+        """Opção 2: Pagamento PIX com dados informados pelo usuário"""
+        print(f"\n{Fore.YELLOW}=== TESTE PAGAMENTO PIX ==={Style.RESET_ALL}")
+        amount = float(input("Digite o valor (ex: 10.50): "))
+        pix_key = input("Digite a chave PIX destino: ").strip()
+        print("Tipos disponíveis: CPF, CNPJ, EMAIL, PHONE, EVP")
+        key_type = input("Digite o tipo da chave: ").strip().upper()
+        client_code = input("Digite um código único do cliente: ").strip()
+        description = input("Digite a descrição: ").strip()
+        
+        result = self.test_pix_payment(amount, pix_key, key_type, client_code, description)
+        if result:
+            self.display_result("PAGAMENTO PIX RESULT", result)
+
+    def _handle_pix_status(self):
+        """Opção 3: Consulta de status PIX"""
+        print(f"\n{Fore.YELLOW}=== CONSULTA STATUS PIX ==={Style.RESET_ALL}")
+        transaction_id = input("Digite o transaction ID: ").strip()
+        
+        result = self.test_pix_status(transaction_id)
+        if result:
+            self.display_result("STATUS PIX RESULT", result)
+
+    def _handle_ted(self):
+        """Opção 4: TED com dados informados pelo usuário"""
+        print(f"\n{Fore.YELLOW}=== TESTE TED ==={Style.RESET_ALL}")
+        amount = float(input("Digite o valor (ex: 100.00): "))
+        bank_code = input("Digite o código do banco (ex: 001): ").strip()
+        agency = input("Digite a agência (ex: 1234): ").strip()
+        account = input("Digite a conta (ex: 12345-6): ").strip()
+        recipient_name = input("Digite o nome do destinatário: ").strip()
+        recipient_doc = input("Digite o CPF/CNPJ do destinatário: ").strip()
+        client_code = input("Digite um código único do cliente: ").strip()
+        
+        result = self.test_ted_transfer(amount, bank_code, agency, account, 
+                                      recipient_name, recipient_doc, client_code)
+        if result:
+            self.display_result("TED RESULT", result)
+
+    def _handle_internal_transfer(self):
+        """Opção 5: Transferência interna com dados informados pelo usuário"""
+        print(f"\n{Fore.YELLOW}=== TESTE TRANSFERÊNCIA INTERNA ==={Style.RESET_ALL}")
+        amount = float(input("Digite o valor (ex: 50.00): "))
+        debit_account = input("Digite a conta de débito: ").strip()
+        credit_account = input("Digite a conta de crédito: ").strip()
+        client_code = input("Digite um código único do cliente: ").strip()
+        description = input("Digite a descrição: ").strip()
+        
+        result = self.test_internal_transfer(amount, debit_account, credit_account, 
+                                           client_code, description)
+        if result:
+            self.display_result("TRANSFERÊNCIA INTERNA RESULT", result)
+
+    def _handle_save_and_exit(self) -> bool:
+        """Opção 7: gera o relatório e encerra"""
+        self.save_report()
+        return True
+
+    def _handle_exit(self) -> bool:
+        """Opção 8: encerra sem relatório"""
+        self.log_info("Encerrando sem gerar relatório...")
+        return True
 
     def run_interactive_test(self):
         """Executa teste interativo"""
@@ -495,95 +939,56 @@ class CelcoinTester:
         print(f"{'='*60}{Style.RESET_ALL}\n")
         
         # Autenticação
-        if not self.authenticate():
+        if not self._ensure_token():
             return
         
+        # Cada opção mapeia para um handler; handlers que retornam True encerram o loop
+        handlers = {
+            "1": self._handle_dict_lookup,
+            "2": self._handle_pix_payment,
+            "3": self._handle_pix_status,
+            "4": self._handle_ted,
+            "5": self._handle_internal_transfer,
+            "6": self.run_pipeline_test,
+            "7": self._handle_save_and_exit,
+            "8": self._handle_exit,
+        }
+        
         while True:
-            print(f"\n{Fore.CYAN}Opções disponíveis:")
-            print("1. Teste DICT Lookup (consulta chave PIX)")
-            print("2. Teste Pagamento PIX")
-            print("3. Consulta Status PIX")
-            print("4. Teste TED")
-            print("5. Teste Transferência Interna")
-            print("6. Executar Pipeline Completo")
-            print("7. Gerar Relatório e Sair")
-            print("8. Sair sem relatório")
-            print(f"{Style.RESET_ALL}")
+            sys.stdout.write(INTERACTIVE_MENU)
             
             choice = input("Escolha uma opção (1-8): ").strip()
             
-            if choice == "1":
-                print(f"\n{Fore.YELLOW}=== TESTE DICT LOOKUP ==={Style.RESET_ALL}")
-                pix_key = input("Digite a chave PIX: ").strip()
-                print("Tipos disponíveis: CPF, CNPJ, EMAIL, PHONE, EVP")
-                key_type = input("Digite o tipo da chave: ").strip().upper()
-                
-                result = self.test_pix_dict_lookup(pix_key, key_type)
-                if result:
-                    self.display_result("DICT LOOKUP RESULT", result)
-                    
-            elif choice == "2":
-                print(f"\n{Fore.YELLOW}=== TESTE PAGAMENTO PIX ==={Style.RESET_ALL}")
-                amount = float(input("Digite o valor (ex: 10.50): "))
-                pix_key = input("Digite a chave PIX destino: ").strip()
-                print("Tipos disponíveis: CPF, CNPJ, EMAIL, PHONE, EVP")
-                key_type = input("Digite o tipo da chave: ").strip().upper()
-                client_code = input("Digite um código único do cliente: ").strip()
-                description = input("Digite a descrição: ").strip()
-                
-                result = self.test_pix_payment(amount, pix_key, key_type, client_code, description)
-                if result:
-                    self.display_result("PAGAMENTO PIX RESULT", result)
-                    
-            elif choice == "3":
-                print(f"\n{Fore.YELLOW}=== CONSULTA STATUS PIX ==={Style.RESET_ALL}")
-                transaction_id = input("Digite o transaction ID: ").strip()
-                
-                result = self.test_pix_status(transaction_id)
-                if result:
-                    self.display_result("STATUS PIX RESULT", result)
-                    
-            elif choice == "4":
-                print(f"\n{Fore.YELLOW}=== TESTE TED ==={Style.RESET_ALL}")
-                amount = float(input("Digite o valor (ex: 100.00): "))
-                bank_code = input("Digite o código do banco (ex: 001): ").strip()
-                agency = input("Digite a agência (ex: 1234): ").strip()
-                account = input("Digite a conta (ex: 12345-6): ").strip()
-                recipient_name = input("Digite o nome do destinatário: ").strip()
-                recipient_doc = input("Digite o CPF/CNPJ do destinatário: ").strip()
-                client_code = input("Digite um código único do cliente: ").strip()
-                
-                result = self.test_ted_transfer(amount, bank_code, agency, account, 
-                                              recipient_name, recipient_doc, client_code)
-                if result:
-                    self.display_result("TED RESULT", result)
-                    
-            elif choice == "5":
-                print(f"\n{Fore.YELLOW}=== TESTE TRANSFERÊNCIA INTERNA ==={Style.RESET_ALL}")
-                amount = float(input("Digite o valor (ex: 50.00): "))
-                debit_account = input("Digite a conta de débito: ").strip()
-                credit_account = input("Digite a conta de crédito: ").strip()
-                client_code = input("Digite um código único do cliente: ").strip()
-                description = input("Digite a descrição: ").strip()
-                
-                result = self.test_internal_transfer(amount, debit_account, credit_account, 
-                                                   client_code, description)
-                if result:
-                    self.display_result("TRANSFERÊNCIA INTERNA RESULT", result)
-                    
-            elif choice == "6":
-                self.run_pipeline_test()
-                
-            elif choice == "7":
-                self.save_report()
-                break
-                
-            elif choice == "8":
-                self.log_info("Encerrando sem gerar relatório...")
-                break
-                
-            else:
+            handler = handlers.get(choice)
+            if handler is None:
                 self.log_warning("Opção inválida. Tente novamente.")
+            elif handler():
+                break
+
+class PixPaymentBatcher:
+    """Acumula pagamentos PIX e envia em lotes de até PIX_BATCH_SIZE
+    
+    O envio acontece ao atingir o tamanho máximo ou na chamada explícita de flush();
+    não há flush por tempo, já que o pipeline gera todos os pagamentos de uma vez.
+    """
+    
+    def __init__(self, tester: CelcoinTester):
+        self.tester = tester
+        self.max_size = tester.config.PIX_BATCH_SIZE
+        self.pending: List[Dict[str, Any]] = []
+        
+    def add(self, payload: Dict[str, Any]):
+        """Adiciona um pagamento, enviando o lote ao atingir o tamanho máximo"""
+        self.pending.append(payload)
+        if len(self.pending) >= self.max_size:
+            self.flush()
+            
+    def flush(self):
+        """Envia os pagamentos pendentes"""
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        self.tester.test_pix_payment_batch(batch)
 
 def main():
     """Função principal"""